@@ -6,15 +6,13 @@ from st_aggrid import AgGrid, GridOptionsBuilder
 import plotly.graph_objs as go
 import plotly.express as px
 import numpy as np
-
-# Matplotlib 中文支持
-import matplotlib.pyplot as plt
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 st.set_page_config(page_title="选矿数据管理系统", page_icon="⛏️", layout="wide")
 
-DATA_PATH = "data.xlsx"
+DATA_PATH = "data.parquet"
+LEGACY_PATHS = ["data.xlsx", "data.csv"]
 COLUMNS = [
     '日期', '原矿吨数', '原矿金品位', '尾液品位', '尾固品位',
     '尾液含金', '尾固含金', '溢流浓度', '溢流细度', '停机时间',
@@ -26,50 +24,241 @@ ALIAS = {
     "浓度": "溢流浓度", "细度": "溢流细度",
     "吨位": "原矿吨数", "金属量": "回收金属量", "日期": "日期"
 }
+METRICS = tuple(c for c in COLUMNS if c != '日期')
+# Parquet 列类型：日期为时间戳，其余均为浮点数
+SCHEMA = pa.schema(
+    [pa.field('日期', pa.timestamp('ns'))] +
+    [pa.field(c, pa.float64()) for c in COLUMNS if c != '日期']
+)
+
+def table_schema(columns, text_columns=()):
+    # 固定列按 SCHEMA 取类型；额外列中的文本列（如备注）按字符串存储，公式列等按浮点数存储
+    return pa.schema([
+        SCHEMA.field(c) if c in SCHEMA.names
+        else pa.field(c, pa.string()) if c in text_columns
+        else pa.field(c, pa.float64())
+        for c in columns
+    ])
+
+def stored_text_columns(schema):
+    return [f.name for f in schema
+            if f.name not in COLUMNS and (pa.types.is_string(f.type) or pa.types.is_large_string(f.type))]
+
+def ensure_columns(df):
+    # 一次 reindex 补齐缺失列（NaN），保留公式列等额外列
+    return df.reindex(columns=COLUMNS + [c for c in df.columns if c not in COLUMNS])
+
+@st.cache_resource
+def _parquet_file():
+    # 文件元数据每个进程只解析一次，写入前由 reset_parquet_file 关闭并失效
+    return pq.ParquetFile(DATA_PATH)
+
+def reset_parquet_file():
+    if os.path.exists(DATA_PATH):
+        _parquet_file().close()
+    _parquet_file.clear()
+
+@st.cache_resource
+def _color_palette():
+    return px.colors.qualitative.Set1 + px.colors.qualitative.Set2
+
+def write_parquet(df):
+    text_columns = []
+    for c in df.columns:
+        if c == '日期' or pd.api.types.is_numeric_dtype(df[c]):
+            continue
+        if c in COLUMNS:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+        else:
+            # 固定列之外的文本列原样保留为字符串，不强转成 NaN
+            df[c] = df[c].astype('string')
+            text_columns.append(c)
+    reset_parquet_file()
+    df.to_parquet(DATA_PATH, engine="pyarrow", compression="zstd", index=False,
+                  schema=table_schema(df.columns, text_columns))
+
+def migrate_legacy_data():
+    # 旧版 data.xlsx / data.csv 只读一次，转存为 parquet 后改名为 .bak 留作备份
+    if os.path.exists(DATA_PATH):
+        return
+    for path in LEGACY_PATHS:
+        if os.path.exists(path):
+            if path.endswith('.csv'):
+                legacy = pd.read_csv(path, parse_dates=['日期'])
+            else:
+                legacy = pd.read_excel(path, parse_dates=['日期'])
+            write_parquet(ensure_columns(legacy))
+            os.replace(path, path + '.bak')
+            return
 
 @st.cache_data
 def load_data():
+    migrate_legacy_data()
     if not os.path.exists(DATA_PATH):
-        pd.DataFrame(columns=COLUMNS).to_excel(DATA_PATH, index=False)
-    df = pd.read_excel(DATA_PATH, parse_dates=['日期'])
-    for col in COLUMNS:
-        if col not in df.columns:
-            df[col] = None
-    return df
+        pq.write_table(SCHEMA.empty_table(), DATA_PATH, compression="zstd")
+    table = _parquet_file().read()
+    extra = [c for c in table.column_names if c not in COLUMNS]
+    schema = table_schema(COLUMNS + extra, stored_text_columns(table.schema))
+    # 按固定 schema 组装，缺失列直接得到带类型的空值
+    table = pa.table([
+        table[c].cast(schema.field(c).type) if c in table.column_names
+        else pa.nulls(table.num_rows, schema.field(c).type)
+        for c in schema.names
+    ], schema=schema)
+    df = table.to_pandas()
+    # 日期列只在加载时解析一次，后续直接使用 datetime64[ns]
+    df['日期'] = pd.to_datetime(df['日期'], errors='coerce').astype('datetime64[ns]')
+    assert df['日期'].dtype == 'datetime64[ns]'
+    # 日期范围随数据一起缓存，任何会话写入后都会随缓存一起刷新
+    return df, df['日期'].min(), df['日期'].max()
 
 def save_data(df):
-    df['日期'] = pd.to_datetime(df['日期'], errors='coerce')
-    df.to_excel(DATA_PATH, index=False)
+    write_parquet(df)
+    st.session_state['data_updated'] = True
+    st.cache_data.clear()
+    st.rerun()
+
+def append_rows(rows):
+    # 新行单独计算派生列后追加到 parquet，无需在内存中拼接整表
+    existing = _parquet_file().read()
+    names = existing.schema.names
+    new_df = derive_data(pd.DataFrame(rows).reindex(columns=names))
+    new_table = pa.Table.from_pandas(
+        new_df, schema=table_schema(names, stored_text_columns(existing.schema)), preserve_index=False)
+    reset_parquet_file()
+    pq.write_table(pa.concat_tables([existing, new_table]), DATA_PATH, compression="zstd")
     st.session_state['data_updated'] = True
     st.cache_data.clear()
     st.rerun()
 
 def derive_data(df):
-    df = df.copy()
+    # 派生列都是新分配的数组，不必先复制整表
     for col in ['原矿吨数', '原矿金品位', '尾液含金', '尾固含金']:
         df[col] = pd.to_numeric(df[col], errors='coerce')
-    df2 = df.dropna(subset=['原矿吨数', '原矿金品位', '尾液含金', '尾固含金'])
-    df2['尾矿品位'] = df2['尾液含金'] + df2['尾固含金']
-    df2['回收率'] = ((df2['原矿金品位'] - df2['尾矿品位']) / df2['原矿金品位']).clip(0, 1)
-    df2['回收金属量'] = df2['原矿吨数'] * df2['原矿金品位'] * df2['回收率']
-    df.update(df2)
+    ore = df['原矿吨数'].to_numpy(dtype=np.float64, copy=False)
+    grade = df['原矿金品位'].to_numpy(dtype=np.float64, copy=False)
+    au_l = df['尾液含金'].to_numpy(dtype=np.float64, copy=False)
+    au_s = df['尾固含金'].to_numpy(dtype=np.float64, copy=False)
+    mask = ~(np.isnan(ore) | np.isnan(grade) | np.isnan(au_l) | np.isnan(au_s))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tailing = au_l + au_s
+        rec = np.clip((grade - tailing) / grade, 0.0, 1.0)
+        metal = ore * grade * rec
+    # 输入不完整的行保留原有值
+    for col, values in (('尾矿品位', tailing), ('回收率', rec), ('回收金属量', metal)):
+        old = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64) if col in df.columns else np.nan
+        df[col] = np.where(mask, values, old)
     return df
 
 def read_uploaded_file(f):
     try:
-        df = pd.read_excel(f)
+        df = pd.read_excel(f, engine='openpyxl')
         df.columns = [ALIAS.get(c.strip(), c.strip()) for c in df.columns]
-        for col in COLUMNS:
-            if col not in df.columns:
-                df[col] = None
-        df = df[COLUMNS]
+        # 一次 reindex 补齐缺失列（float64 NaN），数值列整块转换
+        df = df.reindex(columns=COLUMNS)
         df['日期'] = pd.to_datetime(df['日期'], errors='coerce')
+        num_cols = list(METRICS)
+        df[num_cols] = df[num_cols].apply(pd.to_numeric, errors='coerce').astype('float64')
         return df
     except Exception as e:
         st.error(f"文件读取失败：{e}")
         return pd.DataFrame()
 
-df = load_data()
+# 表格与图表放在片段中，调整控件时只重跑片段，不重新走加载/派生/菜单
+@st.fragment
+def _table_fragment(df):
+    # 1. 设置小数位数（片段内不能写侧边栏，放在表格上方）
+    decimal_places = st.number_input("数值小数位数", min_value=0, max_value=6, value=3, step=1)
+
+    # 2. 生成显示用DataFrame
+    df_show = df.copy()
+    df_show['日期'] = df_show['日期'].dt.strftime('%Y-%m-%d')
+
+    # 动态保留小数位：数值列作为一个二维块一次取整
+    num_cols = df_show.select_dtypes("number").columns
+    arr = df_show[num_cols].to_numpy(dtype=np.float64)
+    arr = np.round(arr, decimal_places)
+    df_show[num_cols] = arr
+
+    # 3. 构建AgGrid参数，自动列宽
+    gb = GridOptionsBuilder.from_dataframe(df_show)
+    gb.configure_default_column(
+        editable=True,
+        resizable=True,
+        autoWidth=True,  # 自动宽度
+        cellStyle={'textAlign': 'center'},
+    )
+    gb.configure_column("日期", width=360)
+    for col in df_show.columns:
+        gb.configure_column(col, filter=False, menuTabs=[])
+
+    gridOptions = gb.build()
+
+    # 4. 渲染表格
+    AgGrid(
+        df_show,
+        gridOptions=gridOptions,
+        fit_columns_on_grid_load=True,  # 自动列宽
+        allow_unsafe_jscode=True,
+        theme='alpine'
+    )
+
+@st.fragment
+def _analysis_fragment(dfp, date_min, date_max):
+    # 固定指标直接用常量，只追加公式列
+    metrics = list(METRICS) + [col for col in dfp.columns if col not in COLUMNS]
+
+    if pd.notna(date_min):
+        min_date = date_min.date()
+        max_date = date_max.date()
+    else:
+        today = datetime.today().date()
+        min_date = max_date = today
+    left, right = st.columns([1, 3])
+    with left:
+        start = st.date_input("开始日期", min_value=min_date, max_value=max_date, value=min_date)
+        end = st.date_input("结束日期", min_value=min_date, max_value=max_date, value=max_date)
+        left_metrics = st.multiselect("左轴指标（虚线）", metrics, default=["回收率"])
+        right_metrics = st.multiselect("右轴指标（实线）", metrics, default=["原矿吨数"])
+        left_zero = st.checkbox("左轴从0开始", value=False)
+        right_zero = st.checkbox("右轴从0开始", value=False)
+    with right:
+        dfsel = dfp[(dfp['日期'] >= np.datetime64(start)) & (dfp['日期'] <= np.datetime64(end))]
+        if not dfsel.empty and (left_metrics or right_metrics):
+            color_list = list(_color_palette())
+            # 一次性构建全部曲线并传入 Figure，直接使用 NumPy 数组
+            x = dfsel['日期'].to_numpy()
+            traces = [
+                go.Scatter(
+                    x=x, y=dfsel[m].to_numpy(), mode='lines+markers',
+                    name=f"左-{m}", yaxis='y1',
+                    line=dict(dash='dash', color=color_list[idx % len(color_list)]),
+                    marker=dict(symbol='circle'),
+                    hovertemplate = f"日期: %{{x|%Y-%m-%d}}<br>{m}: %{{y:.4f}}<extra></extra>",
+                )
+                for idx, m in enumerate(left_metrics)
+            ] + [
+                go.Scatter(
+                    x=x, y=dfsel[m].to_numpy(), mode='lines+markers',
+                    name=f"右-{m}", yaxis='y2',
+                    line=dict(color=color_list[(idx + 5) % len(color_list)]),
+                    marker=dict(symbol='x'),
+                    hovertemplate = f"日期: %{{x|%Y-%m-%d}}<br>{m}: %{{y:.4f}}<extra></extra>",
+                )
+                for idx, m in enumerate(right_metrics)
+            ]
+            layout = dict(
+                xaxis=dict(title='日期'),
+                yaxis=dict(title='左轴', zeroline=left_zero, rangemode='tozero' if left_zero else 'normal'),
+                yaxis2=dict(title='右轴', overlaying='y', side='right', zeroline=right_zero, rangemode='tozero' if right_zero else 'normal'),
+                legend=dict(x=0.01, y=0.99), hovermode='x unified', margin=dict(l=20, r=20, t=20, b=40)
+            )
+            fig = go.Figure(data=traces, layout=layout)
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("请选择有效的日期范围和指标")
+
+df, date_min, date_max = load_data()
 if 'data_updated' not in st.session_state:
     st.session_state['data_updated'] = False
 
@@ -106,7 +295,7 @@ if menu == "输入数据":
         grind = cols[2].number_input("溢流细度", min_value=0.0, format="%.2f")
         stop = cols[2].number_input("停机时间", min_value=0.0, format="%.0f")
         if st.form_submit_button("保存"):
-            row = pd.DataFrame([{
+            append_rows([{
                 "日期": pd.to_datetime(date),
                 "原矿吨数": ore, "原矿金品位": grade,
                 "尾液品位": tail_solu_grade, "尾固品位": tail_solid_grade,
@@ -114,47 +303,12 @@ if menu == "输入数据":
                 "溢流浓度": conc, "溢流细度": grind, "停机时间": stop,
                 "尾矿品位": None, "回收率": None, "回收金属量": None
             }])
-            combined = pd.concat([df, row], ignore_index=True)
-            save_data(derive_data(combined))
             st.success("已保存")
 
 elif menu == "数据表":
     st.header("数据表管理")
 
-    # 1. 在侧边栏设置小数位数
-    decimal_places = st.sidebar.number_input("数值小数位数", min_value=0, max_value=6, value=3, step=1)
-
-    # 2. 生成显示用DataFrame
-    df_show = df.copy()
-    df_show['日期'] = pd.to_datetime(df_show['日期'], errors='coerce').dt.strftime('%Y-%m-%d')
-
-    for c in df_show.columns:
-        if c != '日期':
-            # 动态保留小数位
-            df_show[c] = np.round(pd.to_numeric(df_show[c], errors='coerce'), decimal_places)
-
-    # 3. 构建AgGrid参数，自动列宽
-    gb = GridOptionsBuilder.from_dataframe(df_show)
-    gb.configure_default_column(
-        editable=True,
-        resizable=True,
-        autoWidth=True,  # 自动宽度
-        cellStyle={'textAlign': 'center'},
-    )
-    gb.configure_column("日期", width=360)
-    for col in df_show.columns:
-        gb.configure_column(col, filter=False, menuTabs=[])
-
-    gridOptions = gb.build()
-
-    # 4. 渲染表格
-    AgGrid(
-        df_show,
-        gridOptions=gridOptions,
-        fit_columns_on_grid_load=True,  # 自动列宽
-        allow_unsafe_jscode=True,
-        theme='alpine'
-    )
+    _table_fragment(df)
 
     # 5. 添加公式列表单
     st.markdown("### 添加公式列")
@@ -163,66 +317,20 @@ elif menu == "数据表":
         new_col = col1.text_input("新列名")
         formula = col2.text_input("公式（如：原矿吨数 * 原矿金品位 * 回收率）")
         if st.form_submit_button("添加") and new_col and formula:
-            try:
-                df[new_col] = df.eval(formula)
-                save_data(df)
-                st.success(f"已添加新列 {new_col}")
-                st.rerun()
-            except Exception as e:
-                st.error(f"公式有误：{e}")
+            # numexpr 不支持 datetime64，引用日期的公式提前拒绝
+            if '日期' in formula:
+                st.error("公式有误：不能引用日期列")
+            else:
+                try:
+                    df[new_col] = df.eval(formula, engine='numexpr', local_dict={})
+                    save_data(df)
+                    st.success(f"已添加新列 {new_col}")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"公式有误：{e}")
 
 elif menu == "分析图表":
     st.header("指标趋势分析")
-    dfp = df.copy()  # 这里是关键，确保dfp变量存在
-    dfp['日期'] = pd.to_datetime(dfp['日期'], errors='coerce')
-    dfp = dfp.dropna(subset=['日期'])
-    metrics = [col for col in dfp.columns if col != '日期']  # <-- 在这里定义
-    dfp = df.copy()
-    dfp['日期'] = pd.to_datetime(dfp['日期'], errors='coerce')
-    dfp = dfp.dropna(subset=['日期'])
-    metrics = [col for col in dfp.columns if col != '日期']
-
-    if dfp['日期'].notna().any():
-        min_date = dfp['日期'].min().date()
-        max_date = dfp['日期'].max().date()
-    else:
-        today = datetime.today().date()
-        min_date = max_date = today
-    left, right = st.columns([1, 3])
-    with left:
-        start = st.date_input("开始日期", min_value=min_date, max_value=max_date, value=min_date)
-        end = st.date_input("结束日期", min_value=min_date, max_value=max_date, value=max_date)
-        left_metrics = st.multiselect("左轴指标（虚线）", metrics, default=["回收率"])
-        right_metrics = st.multiselect("右轴指标（实线）", metrics, default=["原矿吨数"])
-        left_zero = st.checkbox("左轴从0开始", value=False)
-        right_zero = st.checkbox("右轴从0开始", value=False)
-    with right:
-        dfsel = dfp[(dfp['日期'] >= pd.to_datetime(start)) & (dfp['日期'] <= pd.to_datetime(end))]
-        if not dfsel.empty and (left_metrics or right_metrics):
-            fig = go.Figure()
-            color_list = px.colors.qualitative.Set1 + px.colors.qualitative.Set2
-            for idx, m in enumerate(left_metrics):
-                fig.add_trace(go.Scatter(
-                    x=dfsel['日期'], y=dfsel[m], mode='lines+markers',
-                    name=f"左-{m}", yaxis='y1',
-                    line=dict(dash='dash', color=color_list[idx % len(color_list)]),
-                    marker=dict(symbol='circle'),
-                    hovertemplate = f"日期: %{{x|%Y-%m-%d}}<br>{m}: %{{y:.4f}}<extra></extra>",
-                ))
-            for idx, m in enumerate(right_metrics):
-                fig.add_trace(go.Scatter(
-                    x=dfsel['日期'], y=dfsel[m], mode='lines+markers',
-                    name=f"右-{m}", yaxis='y2',
-                    line=dict(color=color_list[(idx + 5) % len(color_list)]),
-                    marker=dict(symbol='x'),
-                    hovertemplate = f"日期: %{{x|%Y-%m-%d}}<br>{m}: %{{y:.4f}}<extra></extra>",
-                ))
-            fig.update_layout(
-                xaxis=dict(title='日期'),
-                yaxis=dict(title='左轴', zeroline=left_zero, rangemode='tozero' if left_zero else 'normal'),
-                yaxis2=dict(title='右轴', overlaying='y', side='right', zeroline=right_zero, rangemode='tozero' if right_zero else 'normal'),
-                legend=dict(x=0.01, y=0.99), hovermode='x unified', margin=dict(l=20, r=20, t=20, b=40)
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("请选择有效的日期范围和指标")
+    # 日期已在 load_data 中统一解析，这里只需去掉空日期；
+    # 片段重跑时沿用这次的参数，不会重复预处理
+    _analysis_fragment(df.dropna(subset=['日期']), date_min, date_max)
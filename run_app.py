@@ -8,6 +8,8 @@ if __name__ == "__main__":
         current_dir = os.path.dirname(os.path.abspath(__file__))
     file_path = os.path.join(current_dir, "app.py")
 
+    # 不预先探测空闲端口、也不指定 --server.port：未手动配置端口时，
+    # Streamlit 绑定失败会自行顺延到下一个端口，没有“探测后再绑定”的竞争
     sys.argv = ["streamlit", "run", file_path,
         "--server.enableCORS=true", "--server.enableXsrfProtection=false",
         "--global.developmentMode=false", "--client.toolbarMode=minimal"]
@@ -1,3 +1,11 @@
+import sys
+from PyInstaller.utils.hooks import collect_submodules
+
+excludes = ['matplotlib']
+if sys.platform == 'win32':
+    # fsevents 仅用于 macOS
+    excludes.append('watchdog.observers.fsevents')
+
 a = Analysis(
     ['run_app.py'],
     pathex=[],
@@ -8,8 +16,7 @@ a = Analysis(
         ("C:/Users/dt/AppData/Local/Programs/Python/Python312/Lib/site-packages/streamlit/runtime", "./streamlit/runtime"),
         ("C:/Users/dt/AppData/Local/Programs/Python/Python312/Lib/site-packages/st_aggrid/frontend/build", "./st_aggrid/frontend/build"),
         ("C:/Users/dt/AppData/Local/Programs/Python/Python312/Lib/site-packages/st_aggrid/json", "./st_aggrid/json"),
-        ("data.xlsx", "."),
-    ]
+    ],
     hiddenimports=[
         'streamlit',
         'pandas',
@@ -20,31 +27,31 @@ a = Analysis(
         'plotly.express',
         'plotly',            # 补加主包
         'numpy',
+        'numexpr',
         'xlrd',
         'openpyxl',
-    ],
+        'pyarrow',
+    ] + collect_submodules('pandas._libs'),  # pandas 运行时只需要 _libs 扩展模块
     hookspath=['./hooks'],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=excludes,
     noarchive=False,
     optimize=0,
 )
 pyz = PYZ(a.pure)
 
+# onedir 打包：启动时无需先解压到临时目录
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='dataanalysis',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
     upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
     console=True,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -52,3 +59,12 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    name='dataanalysis',
+)